@@ -1,4 +1,7 @@
 import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from functools import wraps
 from io import BytesIO
@@ -19,7 +22,7 @@ class User(db.Model):
     role = db.Column(db.String(20), nullable=False)
 
     def set_password(self, password: str) -> None:
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method="scrypt:32768:8:1")
 
     def check_password(self, password: str) -> bool:
         return check_password_hash(self.password_hash, password)
@@ -44,7 +47,9 @@ class MenuItem(db.Model):
 
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    table_id = db.Column(db.Integer, db.ForeignKey("dining_table.id"), nullable=False)
+    table_id = db.Column(
+        db.Integer, db.ForeignKey("dining_table.id"), nullable=False, index=True
+    )
     status = db.Column(db.String(20), default="pending", nullable=False)
     total_amount = db.Column(db.Float, default=0.0, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -58,6 +63,11 @@ class Order(db.Model):
     items = db.relationship("OrderItem", backref="order", cascade="all, delete-orphan")
     created_by = db.relationship("User")
 
+    __table_args__ = (
+        db.Index("ix_order_status_created", status, created_at.desc()),
+        db.Index("ix_order_status_paid_at", status, paid_at),
+    )
+
     @property
     def is_active(self) -> bool:
         return self.status not in {"paid", "cancelled"}
@@ -81,7 +91,24 @@ class OrderItem(db.Model):
         return round(self.quantity * self.price, 2)
 
 
+SessionUser = namedtuple("SessionUser", ["id", "username", "role"])
+TableRef = namedtuple("TableRef", ["id", "code", "name"])
+
+
 STATUS_FLOW = ["pending", "preparing", "served", "completed", "paid"]
+STATUS_SET = frozenset(STATUS_FLOW)
+TABLE_CACHE_TTL = 300
+YEAR_CACHE_TTL = 3600
+
+_year_cache = {"year": None, "expires": 0.0}
+
+
+def current_year() -> int:
+    now = time.monotonic()
+    if now >= _year_cache["expires"]:
+        _year_cache["year"] = datetime.utcnow().year
+        _year_cache["expires"] = now + YEAR_CACHE_TTL
+    return _year_cache["year"]
 
 
 def create_app() -> Flask:
@@ -96,21 +123,25 @@ def create_app() -> Flask:
 
     @app.before_request
     def load_logged_in_user() -> None:
-        user_id = session.get("user_id")
-        g.user = User.query.get(user_id) if user_id else None
+        user_data = session.get("user")
+        g.user = SessionUser(**user_data) if user_data else None
 
     @app.context_processor
     def inject_globals():
         return {
             "current_user": g.get("user"),
             "STATUS_FLOW": STATUS_FLOW,
-            "current_year": datetime.utcnow().year,
+            "current_year": current_year(),
         }
 
     def login_required(roles=None):
         def decorator(view):
             @wraps(view)
             def wrapped_view(**kwargs):
+                if g.user is not None and request.method == "POST":
+                    g.user = db.session.get(User, g.user.id)
+                    if g.user is None:
+                        session.clear()
                 if g.user is None:
                     flash("กรุณาเข้าสู่ระบบก่อน", "warning")
                     return redirect(url_for("login"))
@@ -127,17 +158,73 @@ def create_app() -> Flask:
         return decorator
 
     def parse_order_items(form_data, menu_items):
+        menu_by_key = {f"item_{item.id}": item for item in menu_items}
         selected_items = []
-        for item in menu_items:
-            raw_qty = form_data.get(f"item_{item.id}")
+        for key, raw_qty in form_data.items():
+            item = menu_by_key.get(key)
+            if item is None:
+                continue
             try:
                 qty = int(raw_qty or 0)
             except ValueError:
-                qty = 0
+                continue
             if qty > 0:
                 selected_items.append((item, qty))
         return selected_items
 
+    table_cache = {}
+
+    def get_table_or_404(code):
+        code = code.upper()
+        cached = table_cache.get(code)
+        if cached is None or cached[2] < time.monotonic():
+            table = DiningTable.query.filter_by(code=code).first_or_404()
+            cached = (table.id, table.name, time.monotonic() + TABLE_CACHE_TTL)
+            table_cache[code] = cached
+        return TableRef(id=cached[0], code=code, name=cached[1])
+
+    qr_cache = {}
+    qr_executor = ThreadPoolExecutor(max_workers=2)
+
+    def render_qr_png(qr_url):
+        import qrcode
+
+        img = qrcode.make(qr_url)
+        buffer = BytesIO()
+        img.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    def prerender_qr_png(code, qr_url):
+        def store(future):
+            if future.exception() is None:
+                qr_cache[code] = (qr_url, future.result())
+
+        qr_executor.submit(render_qr_png, qr_url).add_done_callback(store)
+
+    def create_order(table_id, selected_items, created_by_id=None):
+        total = round(sum(menu_item.price * qty for menu_item, qty in selected_items), 2)
+        order = Order(
+            table_id=table_id,
+            status="pending",
+            created_by_id=created_by_id,
+            total_amount=total,
+        )
+        db.session.add(order)
+        db.session.flush()
+        db.session.execute(
+            OrderItem.__table__.insert(),
+            [
+                {
+                    "order_id": order.id,
+                    "menu_item_id": menu_item.id,
+                    "quantity": qty,
+                    "price": menu_item.price,
+                }
+                for menu_item, qty in selected_items
+            ],
+        )
+        return order
+
     @app.route("/")
     def index():
         if g.user:
@@ -155,7 +242,11 @@ def create_app() -> Flask:
             user = User.query.filter_by(username=username).first()
             if user and user.check_password(password):
                 session.clear()
-                session["user_id"] = user.id
+                session["user"] = {
+                    "id": user.id,
+                    "username": user.username,
+                    "role": user.role,
+                }
                 flash("เข้าสู่ระบบสำเร็จ", "success")
                 if user.role == "admin":
                     return redirect(url_for("admin_dashboard"))
@@ -173,23 +264,29 @@ def create_app() -> Flask:
     @app.route("/admin/dashboard")
     @login_required(roles="admin")
     def admin_dashboard():
-        total_sales = (
-            db.session.query(db.func.coalesce(db.func.sum(Order.total_amount), 0))
-            .filter(Order.status == "paid")
-            .scalar()
-        )
         today = datetime.utcnow().date()
-        today_sales = (
-            db.session.query(db.func.coalesce(db.func.sum(Order.total_amount), 0))
-            .filter(
-                Order.status == "paid",
-                Order.paid_at.isnot(None),
-                db.func.date(Order.paid_at) == today.isoformat(),
+        total_sales, today_sales = (
+            db.session.query(
+                db.func.coalesce(db.func.sum(Order.total_amount), 0),
+                db.func.coalesce(
+                    db.func.sum(
+                        db.case(
+                            (
+                                db.func.date(Order.paid_at) == today.isoformat(),
+                                Order.total_amount,
+                            ),
+                            else_=0,
+                        )
+                    ),
+                    0,
+                ),
             )
-            .scalar()
+            .filter(Order.status == "paid")
+            .one()
         )
         open_orders = (
-            Order.query.filter(Order.status != "paid")
+            Order.query.options(db.joinedload(Order.table))
+            .filter(Order.status != "paid")
             .order_by(Order.created_at.desc())
             .limit(10)
             .all()
@@ -240,7 +337,7 @@ def create_app() -> Flask:
     @app.route("/admin/menu/<int:item_id>/edit", methods=["GET", "POST"])
     @login_required(roles="admin")
     def admin_menu_edit(item_id):
-        item = MenuItem.query.get_or_404(item_id)
+        item = db.get_or_404(MenuItem, item_id)
         if request.method == "POST":
             name = request.form.get("name", "").strip()
             description = request.form.get("description", "").strip()
@@ -268,7 +365,7 @@ def create_app() -> Flask:
     @app.route("/admin/menu/<int:item_id>/delete", methods=["POST"])
     @login_required(roles="admin")
     def admin_menu_delete(item_id):
-        item = MenuItem.query.get_or_404(item_id)
+        item = db.get_or_404(MenuItem, item_id)
         db.session.delete(item)
         db.session.commit()
         flash("ลบเมนูเรียบร้อย", "info")
@@ -288,6 +385,7 @@ def create_app() -> Flask:
                 table = DiningTable(name=name, code=code)
                 db.session.add(table)
                 db.session.commit()
+                prerender_qr_png(code, url_for("table_view", code=code, _external=True))
                 flash("เพิ่มโต๊ะเรียบร้อย", "success")
             return redirect(url_for("admin_tables"))
         tables = DiningTable.query.order_by(DiningTable.code).all()
@@ -296,28 +394,28 @@ def create_app() -> Flask:
     @app.route("/admin/tables/<int:table_id>/delete", methods=["POST"])
     @login_required(roles="admin")
     def admin_table_delete(table_id):
-        table = DiningTable.query.get_or_404(table_id)
+        table = db.get_or_404(DiningTable, table_id)
         if table.orders:
             flash("ไม่สามารถลบโต๊ะที่มีออเดอร์อยู่ได้", "danger")
         else:
             db.session.delete(table)
             db.session.commit()
+            table_cache.pop(table.code, None)
+            qr_cache.pop(table.code, None)
             flash("ลบโต๊ะเรียบร้อย", "info")
         return redirect(url_for("admin_tables"))
 
     @app.route("/admin/tables/<int:table_id>/qr")
     @login_required(roles="admin")
     def admin_table_qr(table_id):
-        import qrcode
-
-        table = DiningTable.query.get_or_404(table_id)
+        table = db.get_or_404(DiningTable, table_id)
         qr_url = url_for("table_view", code=table.code, _external=True)
-        img = qrcode.make(qr_url)
-        buffer = BytesIO()
-        img.save(buffer, format="PNG")
-        buffer.seek(0)
+        cached_url, png = qr_cache.get(table.code, (None, None))
+        if cached_url != qr_url:
+            png = render_qr_png(qr_url)
+            qr_cache[table.code] = (qr_url, png)
         return send_file(
-            buffer,
+            BytesIO(png),
             mimetype="image/png",
             as_attachment=True,
             download_name=f"table_{table.code}.png",
@@ -328,8 +426,9 @@ def create_app() -> Flask:
     @login_required(roles=["staff", "admin"])
     def staff_dashboard():
         open_orders = (
-            Order.query.order_by(Order.created_at.desc())
+            Order.query.options(db.joinedload(Order.table))
             .filter(Order.status != "paid")
+            .order_by(Order.created_at.desc())
             .all()
         )
         tables = DiningTable.query.order_by(DiningTable.code).all()
@@ -341,8 +440,9 @@ def create_app() -> Flask:
         tables = DiningTable.query.order_by(DiningTable.code).all()
         menu_items = MenuItem.query.filter_by(available=True).order_by(MenuItem.name).all()
         if request.method == "POST":
-            table_id = request.form.get("table_id")
-            table = DiningTable.query.get(table_id)
+            tables_by_id = {table.id: table for table in tables}
+            table_id = request.form.get("table_id", "")
+            table = tables_by_id.get(int(table_id)) if table_id.isdecimal() else None
             if not table:
                 flash("กรุณาเลือกโต๊ะ", "danger")
                 return render_template(
@@ -354,17 +454,7 @@ def create_app() -> Flask:
                 return render_template(
                     "staff/order_form.html", tables=tables, menu_items=menu_items
                 )
-            order = Order(table=table, status="pending", created_by=g.user)
-            db.session.add(order)
-            for menu_item, qty in selected_items:
-                order_item = OrderItem(
-                    order=order,
-                    menu_item=menu_item,
-                    quantity=qty,
-                    price=menu_item.price,
-                )
-                db.session.add(order_item)
-            order.recalculate_total()
+            order = create_order(table.id, selected_items, created_by_id=g.user.id)
             db.session.commit()
             flash("สร้างออเดอร์เรียบร้อย", "success")
             return redirect(url_for("staff_order_detail", order_id=order.id))
@@ -375,34 +465,50 @@ def create_app() -> Flask:
     @app.route("/staff/orders/<int:order_id>")
     @login_required(roles=["staff", "admin"])
     def staff_order_detail(order_id):
-        order = Order.query.get_or_404(order_id)
+        order = (
+            Order.query.options(
+                db.joinedload(Order.table),
+                db.selectinload(Order.items).joinedload(OrderItem.menu_item),
+            )
+            .filter_by(id=order_id)
+            .first_or_404()
+        )
         return render_template("staff/order_detail.html", order=order)
 
     @app.route("/staff/orders/<int:order_id>/status", methods=["POST"])
     @login_required(roles=["staff", "admin"])
     def staff_update_status(order_id):
-        order = Order.query.get_or_404(order_id)
         status = request.form.get("status")
-        if status not in STATUS_FLOW:
+        if status not in STATUS_SET:
+            db.get_or_404(Order, order_id)
             flash("สถานะไม่ถูกต้อง", "danger")
         else:
-            order.status = status
-            order.updated_at = datetime.utcnow()
+            now = datetime.utcnow()
+            paid_at = payment_method = None
             if status == "paid":
-                order.paid_at = datetime.utcnow()
-                payment_method = request.form.get("payment_method", "").strip()
-                order.payment_method = payment_method or None
-            else:
-                order.payment_method = None
-                order.paid_at = None
+                paid_at = now
+                payment_method = request.form.get("payment_method", "").strip() or None
+            result = db.session.execute(
+                db.update(Order)
+                .where(Order.id == order_id)
+                .values(
+                    status=status,
+                    updated_at=now,
+                    paid_at=paid_at,
+                    payment_method=payment_method,
+                )
+            )
+            if result.rowcount == 0:
+                db.session.rollback()
+                abort(404)
             db.session.commit()
             flash("อัปเดตสถานะเรียบร้อย", "success")
-        return redirect(url_for("staff_order_detail", order_id=order.id))
+        return redirect(url_for("staff_order_detail", order_id=order_id))
 
     @app.route("/staff/orders/<int:order_id>/acknowledge", methods=["POST"])
     @login_required(roles=["staff", "admin"])
     def staff_acknowledge(order_id):
-        order = Order.query.get_or_404(order_id)
+        order = db.get_or_404(Order, order_id)
         order.requested_assistance = False
         order.updated_at = datetime.utcnow()
         db.session.commit()
@@ -412,14 +518,21 @@ def create_app() -> Flask:
     # ------------------- Customer views -------------------
     @app.route("/table/<code>", methods=["GET", "POST"])
     def table_view(code):
-        table = DiningTable.query.filter_by(code=code.upper()).first_or_404()
-        menu_items = MenuItem.query.filter_by(available=True).order_by(MenuItem.name).all()
+        table = get_table_or_404(code)
+        menu_items = db.session.execute(
+            db.select(MenuItem.id, MenuItem.name, MenuItem.price, MenuItem.description)
+            .filter_by(available=True)
+            .order_by(MenuItem.name)
+        ).all()
         active_orders = (
-            Order.query.filter(Order.table == table, Order.status != "paid")
+            Order.query.filter(Order.table_id == table.id, Order.status != "paid")
             .order_by(Order.created_at.desc())
             .all()
         )
         if request.method == "POST":
+            if db.session.get(DiningTable, table.id) is None:
+                table_cache.pop(table.code, None)
+                abort(404)
             selected_items = parse_order_items(request.form, menu_items)
             if not selected_items:
                 flash("กรุณาเลือกเมนูอย่างน้อย 1 รายการ", "danger")
@@ -429,17 +542,7 @@ def create_app() -> Flask:
                     menu_items=menu_items,
                     active_orders=active_orders,
                 )
-            order = Order(table=table, status="pending")
-            db.session.add(order)
-            for menu_item, qty in selected_items:
-                order_item = OrderItem(
-                    order=order,
-                    menu_item=menu_item,
-                    quantity=qty,
-                    price=menu_item.price,
-                )
-                db.session.add(order_item)
-            order.recalculate_total()
+            order = create_order(table.id, selected_items)
             db.session.commit()
             flash("ส่งออเดอร์เรียบร้อย กรุณารอพนักงานยืนยัน", "success")
             return redirect(url_for("customer_order_summary", code=table.code, order_id=order.id))
@@ -452,14 +555,20 @@ def create_app() -> Flask:
 
     @app.route("/table/<code>/orders/<int:order_id>")
     def customer_order_summary(code, order_id):
-        table = DiningTable.query.filter_by(code=code.upper()).first_or_404()
-        order = Order.query.filter_by(id=order_id, table=table).first_or_404()
+        table = get_table_or_404(code)
+        order = (
+            Order.query.options(
+                db.selectinload(Order.items).joinedload(OrderItem.menu_item)
+            )
+            .filter_by(id=order_id, table_id=table.id)
+            .first_or_404()
+        )
         return render_template("customer/order_summary.html", table=table, order=order)
 
     @app.route("/table/<code>/orders/<int:order_id>/call", methods=["POST"])
     def customer_call_staff(code, order_id):
-        table = DiningTable.query.filter_by(code=code.upper()).first_or_404()
-        order = Order.query.filter_by(id=order_id, table=table).first_or_404()
+        table = get_table_or_404(code)
+        order = Order.query.filter_by(id=order_id, table_id=table.id).first_or_404()
         order.requested_assistance = True
         order.updated_at = datetime.utcnow()
         db.session.commit()
@@ -472,14 +581,24 @@ def create_app() -> Flask:
             seed_data()
 
     def seed_data() -> None:
-        if User.query.count() == 0:
+        has_users, has_tables, has_menu = db.session.execute(
+            db.select(
+                db.select(User.id).exists(),
+                db.select(DiningTable.id).exists(),
+                db.select(MenuItem.id).exists(),
+            )
+        ).one()
+        if has_users and has_tables and has_menu:
+            return
+
+        if not has_users:
             admin = User(username="admin", role="admin")
             admin.set_password("admin123")
             staff = User(username="staff", role="staff")
             staff.set_password("staff123")
             db.session.add_all([admin, staff])
 
-        if DiningTable.query.count() == 0:
+        if not has_tables:
             tables = [
                 DiningTable(name="โต๊ะ 1", code="T1"),
                 DiningTable(name="โต๊ะ 2", code="T2"),
@@ -487,7 +606,7 @@ def create_app() -> Flask:
             ]
             db.session.add_all(tables)
 
-        if MenuItem.query.count() == 0:
+        if not has_menu:
             menu_items = [
                 MenuItem(name="ผัดไทยกุ้งสด", price=80.0, category="อาหารจานหลัก"),
                 MenuItem(name="ต้มยำกุ้ง", price=120.0, category="ซุป"),